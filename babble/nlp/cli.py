@@ -13,8 +13,19 @@ log = logging.getLogger("babble")
 @click.command()
 @click.argument("phrase")
 @click.option("--domain", help="Domain file with intents and rules", required=True)
+@click.option(
+    "--bounded", is_flag=True, help="Limit matched spans to the width of the rules"
+)
+@click.option("--max-seconds", type=float, help="Time budget for the evaluation")
 @click.option("-v", "--verbose", count=True)
-def main(phrase: str, domain: str, verbose: int, args=None):
+def main(
+    phrase: str,
+    domain: str,
+    bounded: bool,
+    max_seconds: Optional[float],
+    verbose: int,
+    args=None,
+):
     """Console script for babble."""
 
     # Setup logging
@@ -24,7 +35,9 @@ def main(phrase: str, domain: str, verbose: int, args=None):
         log.setLevel(logging.DEBUG)
 
     engine = Engine(domain)
-    understanding: Optional[Understanding] = engine.evaluate(phrase)
+    understanding: Optional[Understanding] = engine.evaluate(
+        phrase, bounded=bounded, max_seconds=max_seconds
+    )
     if understanding is not None:
         click.echo(str(understanding.as_dict()))
     return 0
@@ -1,12 +1,16 @@
 import json
 import os
 import logging
+import threading
 import time
 from typing import Optional, Dict, List, Tuple, Union
 
 from babble.nlp.parser import (
+    DEFAULT_MATCH_CACHE_SIZE,
     IntentTransformer,
+    MatchCache,
     RuleTransformer,
+    RuleWidthTransformer,
     create_parser,
     remove_apostrophe,
 )
@@ -17,22 +21,35 @@ log = logging.getLogger("babble")
 class Understanding:
     """Understanding is the result of the evaluation of a phrase."""
 
-    def __init__(self, phrase: str, intent: str, required_matched_classifiers: int):
+    def __init__(
+        self, phrase: str, intent: Optional[str], required_matched_classifiers: int
+    ):
         self.phrase: str = phrase
         """Origin phrase from which the understanding was build"""
-        self.intent: str = intent
-        """Intention which could be understood from the origin phrase"""
+        self.intent: Optional[str] = intent
+        """Intention which could be understood from the origin phrase. None
+        if the evaluation was truncated before any intent was understood."""
         self.slots: List[Dict[str, Union[str, List[str]]]] = []
         """Slots store informations related to the understanding of the
         phrase"""
         self.required_matched_classifiers: int = required_matched_classifiers
         """Number of required classifieres to be found"""
+        self.truncated: Optional[bool] = None
+        """True if the evaluation ran out of budget before all intents were
+        tested. The understanding is the best one found so far. None if the
+        evaluation had no budget."""
 
     def __str__(self):
         return str(self.as_dict())
 
+    def __bool__(self) -> bool:
+        """An understanding without intent is not understood"""
+        return self.intent is not None
+
     def as_dict(self) -> Dict:
         result = {"input": self.phrase, "intent": self.intent, "slots": self.slots}
+        if self.truncated is not None:
+            result["truncated"] = self.truncated
 
         processed = []
         for slot in self.slots:
@@ -67,6 +84,8 @@ class Understanding:
 
     def is_complete(self) -> bool:
         """Returns true if we found slots at least slots"""
+        if self.intent is None:
+            return False
         count = 0
         for slot in self.slots:
             if isinstance(slot["value"], list):
@@ -76,62 +95,129 @@ class Understanding:
         return count == self.required_matched_classifiers
 
 
+class Budget:
+    """Budget limits the work done while evaluating a single phrase. The work
+    is limited by time in seconds and/or by the number of tested spans."""
+
+    def __init__(
+        self, max_seconds: Optional[float] = None, max_steps: Optional[int] = None
+    ):
+        self.deadline: Optional[float] = None
+        if max_seconds is not None:
+            self.deadline = time.perf_counter() + max_seconds
+        self.max_steps: Optional[int] = max_steps
+        self.steps: int = 0
+        self.exhausted: bool = False
+        """True once the budget has been used up"""
+
+    def is_limited(self) -> bool:
+        """Returns True if a time or step limit was given"""
+        return self.deadline is not None or self.max_steps is not None
+
+    def spend(self) -> bool:
+        """Spends one step of the budget. Returns False if the budget is
+        exhausted."""
+        self.steps += 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            self.exhausted = True
+        elif self.deadline is not None and time.perf_counter() > self.deadline:
+            self.exhausted = True
+        return not self.exhausted
+
+
 class Engine:
     """Engine will evaluate a given phrase and tries to understand the meaning
     of the phrase based on a given domain"""
 
-    def __init__(self, path_to_domain_config: str):
-        self.domain = []
+    def __init__(
+        self,
+        path_to_domain_config: str,
+        match_cache_size: int = DEFAULT_MATCH_CACHE_SIZE,
+    ):
+        self.path_to_domain_config: str = path_to_domain_config
+        self.match_cache: MatchCache = MatchCache(max_bytes=match_cache_size)
+        """Cache of fuzzy match decisions shared by all evaluations. Size is
+        given in bytes, 0 disables the cache."""
+        self.parser = create_parser()
+        self.transformer = IntentTransformer()
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """(Re)loads the domain from the domain config and clears the match
+        cache.
+
+        The new domain is built completely before it replaces the old one, so
+        evaluations running in other threads see either the old or the new
+        domain, but never a mix of both."""
+        path_to_domain_config = self.path_to_domain_config
+        domain: List[Dict] = []
         with open(path_to_domain_config) as f:
             basedir = os.path.dirname(path_to_domain_config)
             config = json.load(f)
             if "includes" in config:
                 for path in config["includes"]:
                     with open(os.path.join(basedir, path)) as i:
-                        self.domain.extend(json.load(i))
+                        domain.extend(json.load(i))
             else:
-                self.domain = config
+                domain = config
 
         # Do some preloading of intents with classifiers and prebuild parse
         # trees for rules.
-        self.parser = create_parser()
-        self.transformer = IntentTransformer()
-        self.entities: Dict[str, Dict] = self._load_entities()
-        self.intents: List[Dict] = self._load_intents()
-        self.classifiers_rule_trees: Dict = self._load_classifier_rule_trees()
+        entities = self._load_entities(domain)
+        intents = self._load_intents(domain, entities)
+        classifiers_rule_trees = self._load_classifier_rule_trees(intents, entities)
+        classifiers_max_width = {
+            classifier: RuleWidthTransformer().transform(tree)
+            for classifier, tree in classifiers_rule_trees.items()
+        }
 
-    def _load_classifier_rule_trees(self) -> Dict:
+        with self._lock:
+            self.domain: List[Dict] = domain
+            self.entities: Dict[str, Dict] = entities
+            self.intents: List[Dict] = intents
+            self.classifiers_rule_trees: Dict = classifiers_rule_trees
+            self.classifiers_max_width: Dict[str, int] = classifiers_max_width
+            self.match_cache.clear()
+
+    def _load_classifier_rule_trees(
+        self, intents: List[Dict], entities: Dict[str, Dict]
+    ) -> Dict:
         rules = {}
-        for intent in self.intents:
+        for intent in intents:
             for classifier in intent.get("classifiers", []):
                 if classifier in rules:
                     continue
-                rule = self._resolve_rule_from_classifier(classifier=classifier)
+                rule = self._resolve_rule_from_classifier(classifier, entities)
                 tree = self.parser.parse(rule)
                 rules[classifier] = tree
         return rules
 
-    def _load_intents(self) -> List[Dict]:
+    def _load_intents(
+        self, domain: List[Dict], entities: Dict[str, Dict]
+    ) -> List[Dict]:
         def get_number_entities(rule: str) -> int:
             words = rule.replace("<", "").replace(">", "")
             return len(words.split())
 
         intents: List[Dict] = []
-        for element in self.domain:
+        for element in domain:
             if element.get("type") == "intent":
                 rule = element.get("rule", "")
                 tree = self.parser.parse(rule)
                 classifiers = IntentTransformer().transform(tree)
-                element["classifiers"] = self._expand_classifiers(classifiers, [])
+                element["classifiers"] = self._expand_classifiers(
+                    classifiers, [], entities
+                )
                 element.update({"len_rule": len(element["rule"].split(" "))})
                 intents.append(element)
         return sorted(
             intents, key=lambda x: get_number_entities(x.get("rule", "")), reverse=True
         )
 
-    def _load_entities(self) -> Dict[str, Dict]:
+    def _load_entities(self, domain: List[Dict]) -> Dict[str, Dict]:
         entities = {}
-        for element in self.domain:
+        for element in domain:
             if element.get("type") == "entity":
                 entities[element.get("name")] = element
         return entities
@@ -158,12 +244,32 @@ class Engine:
             alternative = max(alternatives_validity, key=alternatives_validity.get)
             return alternative
 
-    def evaluate(self, phrase: str) -> Optional[Understanding]:
+    def evaluate(
+        self,
+        phrase: str,
+        bounded: bool = False,
+        max_seconds: Optional[float] = None,
+        max_steps: Optional[int] = None,
+    ) -> Optional[Understanding]:
         """Returns the Understanding of the given phrase. If phrase could not
-        be understood None is returnd"""
+        be understood None is returnd, or a falsy Understanding without intent
+        if the evaluation was truncated.
+
+        If `bounded` is True a classifier is only matched against spans not
+        wider than the maximum number of words of its rule (plus one word of
+        fuzzyness). `max_seconds` and `max_steps` limit the work done for
+        this call. If the budget is exhausted the best understanding found so
+        far is returned with its `truncated` flag set. If nothing was
+        understood until then, the understanding has no intent and evaluates
+        to False, so the truncation is still reported."""
 
         understandings = []
         start = time.perf_counter()
+        budget = Budget(max_seconds=max_seconds, max_steps=max_steps)
+        with self._lock:
+            intents = self.intents
+            trees = self.classifiers_rule_trees
+            widths = self.classifiers_max_width
         phrase = remove_apostrophe(phrase)
         # Try to match the given phrase with intents.
         #
@@ -171,43 +277,64 @@ class Engine:
         # so that rules of intent matches nearly the length of the phrase.
         # Rules which are too long or short might match, but are not taken into
         # account anyway because of the validity calculation of the match.
-        intents_to_test = self._filter_intents_by_lenght(phrase)
+        intents_to_test = self._filter_intents_by_lenght(intents, phrase)
 
         # Get all understanding
         for intent in intents_to_test:
-            understanding = self._evaluate_intent(intent, phrase)
+            understanding = self._evaluate_intent(
+                intent, phrase, trees, widths, bounded, budget
+            )
             if understanding is not None:
                 understandings.append(understanding)
+            if budget.exhausted:
+                log.debug(f"Budget exhausted after {budget.steps} steps")
+                break
 
         if understandings:
             result = self._get_best_match(understandings)
+        elif budget.exhausted:
+            result = Understanding(phrase, intent=None, required_matched_classifiers=0)
         else:
             result = None
+        if result is not None and budget.is_limited():
+            result.truncated = budget.exhausted
 
         stop = time.perf_counter()
-        log.debug(
-            f"Evaluated {len(self.intents)} intents in {stop - start:0.4f} seconds"
-        )
+        log.debug(f"Evaluated {len(intents)} intents in {stop - start:0.4f} seconds")
+        log.debug(f"Match cache: {self.match_cache.stats()}")
         return result
 
     def _expand_classifiers(
-        self, classifiers: List[str], expanded_classifiers: List[str]
+        self,
+        classifiers: List[str],
+        expanded_classifiers: List[str],
+        entities: Dict[str, Dict],
     ) -> List[str]:
         for classifier in classifiers:
             if is_entity(classifier):
                 entity_name = get_entity_name(classifier)
-                entity = self.entities[entity_name]
+                entity = entities[entity_name]
                 rule = entity["rule"]
                 if is_entity(rule):
                     tree = self.parser.parse(rule)
                     result = IntentTransformer().transform(tree)
                     return self._expand_classifiers(
-                        classifiers=result, expanded_classifiers=expanded_classifiers
+                        classifiers=result,
+                        expanded_classifiers=expanded_classifiers,
+                        entities=entities,
                     )
             expanded_classifiers.append(classifier)
         return expanded_classifiers
 
-    def _evaluate_intent(self, intent: Dict, phrase: str) -> Optional[Understanding]:
+    def _evaluate_intent(
+        self,
+        intent: Dict,
+        phrase: str,
+        trees: Dict,
+        widths: Dict[str, int],
+        bounded: bool,
+        budget: Budget,
+    ) -> Optional[Understanding]:
         intention = intent.get("name", "")
         log.debug("#" * 68)
         log.debug(f"{intention} -> {phrase}")
@@ -227,8 +354,10 @@ class Engine:
 
             # Evaluate and update the remaining phrase to test.
             slot, rest_of_phrase_to_test = self._evaluate_classifier(
-                classifier, rest_of_phrase_to_test
+                classifier, rest_of_phrase_to_test, trees, widths, bounded, budget
             )
+            if budget.exhausted:
+                return None
 
             if slot is not None:
                 understanding.add_slot(slot)
@@ -238,40 +367,61 @@ class Engine:
                     return understanding
         return None
 
-    def _resolve_rule_from_classifier(self, classifier: str) -> str:
+    def _resolve_rule_from_classifier(
+        self, classifier: str, entities: Dict[str, Dict]
+    ) -> str:
         if is_entity(classifier):
             entity_name = get_entity_name(classifier)
-            entity = self.entities[entity_name]
+            entity = entities[entity_name]
             return entity.get("rule", "")
         return classifier
 
     def _evaluate_classifier(
-        self, classifier: str, phrase: str
+        self,
+        classifier: str,
+        phrase: str,
+        trees: Dict,
+        widths: Dict[str, int],
+        bounded: bool,
+        budget: Budget,
     ) -> Tuple[Optional[Dict], str]:
         log.debug("*" * 68)
 
-        tree = self.classifiers_rule_trees[classifier]
+        tree = trees[classifier]
+
+        # In bounded mode only the last words of the growing phrase are
+        # tested. One extra word is allowed to keep fuzzy matches working.
+        max_width = None
+        if bounded:
+            max_width = widths[classifier] + 1
 
         words_to_test = []
         for word in phrase.split():
+            if not budget.spend():
+                return None, phrase
             words_to_test.append(word)
-            phrase_to_test = " ".join(words_to_test)
+            if max_width is not None:
+                phrase_to_test = " ".join(words_to_test[-max_width:])
+            else:
+                phrase_to_test = " ".join(words_to_test)
             log.debug(f"{phrase_to_test} == {classifier}")
-            rule_transformer = RuleTransformer(phrase=phrase_to_test)
+            rule_transformer = RuleTransformer(
+                phrase=phrase_to_test, cache=self.match_cache
+            )
             found, tag = rule_transformer.transform(tree)
             if found:
-                phrase = phrase.replace(phrase_to_test, "", 1)
+                phrase = phrase.replace(" ".join(words_to_test), "", 1)
                 slot = dict(name=get_entity_name(classifier), value=found)
                 if tag:
                     slot["tag"] = tag
                 return slot, phrase
         return None, phrase
 
-    def _filter_intents_by_lenght(self, phrase: str) -> List[Dict]:
+    def _filter_intents_by_lenght(self, intents: List[Dict], phrase: str) -> List[Dict]:
         phrase_len = len(phrase.split(" "))
         min_lim, max_lim = (phrase_len - 3, phrase_len + 3)
         intents_to_test = [
-            intent for intent in self.intents if min_lim < intent["len_rule"] < max_lim
+            intent for intent in intents if min_lim < intent["len_rule"] < max_lim
         ]
         return intents_to_test
 
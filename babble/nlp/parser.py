@@ -1,6 +1,9 @@
 import os
 import re
-from typing import List, Dict, Optional
+import sys
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
 import logging
 
 from babble import PACKAGE_ROOT_DIR
@@ -11,6 +14,12 @@ from lark.visitors import Transformer
 
 log = logging.getLogger("babble")
 BABBLE_PATH_GRAMMAR = os.path.join(PACKAGE_ROOT_DIR, "babble", "nlp", "grammar.lark")
+DEFAULT_MATCH_CACHE_SIZE = 16 * 1024 * 1024
+# Memory used by a cache entry besides its key: the (found, size) value tuple,
+# the size int and the OrderedDict itself. The 80 bytes for the OrderedDict are
+# its hash table slot (including over-allocation) and the node of its linked
+# list, as measured with tracemalloc on CPython 3.11.
+MATCH_CACHE_ENTRY_OVERHEAD = sys.getsizeof((False, 0)) + sys.getsizeof(1000) + 80
 
 
 def create_parser() -> Lark:
@@ -57,10 +66,103 @@ def remove_apostrophe(phrase: str) -> str:
     return phrase
 
 
-def find_in_phrase(phrase: str, to_find: str) -> bool:
+class MatchCache:
+    """Thread safe LRU cache for the decisions of `find_in_phrase`.
+
+    Entries are keyed by (phrase, to_find). The memory used by the entries is
+    estimated and least recently used entries are evicted once the estimate
+    exceeds `max_bytes`. A `max_bytes` of 0 disables the cache."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MATCH_CACHE_SIZE):
+        self.max_bytes: int = max_bytes
+        """Memory budget of the cache in bytes"""
+        self.memory: int = 0
+        """Estimated memory used by the cached entries in bytes"""
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[bool, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, phrase: str, to_find: str) -> Optional[bool]:
+        """Returns the cached decision or None if it is not cached"""
+        key = (phrase, to_find)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, phrase: str, to_find: str, found: bool):
+        key = (phrase, to_find)
+        size = (
+            sys.getsizeof(key)
+            + sys.getsizeof(phrase)
+            + sys.getsizeof(to_find)
+            + MATCH_CACHE_ENTRY_OVERHEAD
+        )
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (found, size)
+            self.memory += size
+            while self.memory > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.memory -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """Removes all entries. The counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.memory = 0
+
+    def reset_stats(self):
+        """Resets the hits, misses and evictions counters."""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "memory": self.memory,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def find_in_phrase(
+    phrase: str, to_find: str, cache: Optional[MatchCache] = None
+) -> bool:
     """Will return True if `to_find` is found in `phrase`. The search is done
     trying a exact match first. If it does not match than a fuzzy match using
-    levensthein is done"""
+    levensthein is done. If a `cache` is given, the decision is looked up
+    there first and stored after it has been computed."""
+
+    if cache is None or not cache.max_bytes:
+        return _find_in_phrase(phrase, to_find)
+
+    found = cache.get(phrase, to_find)
+    if found is None:
+        found = _find_in_phrase(phrase, to_find)
+        cache.put(phrase, to_find, found)
+    return found
+
+
+def _find_in_phrase(phrase: str, to_find: str) -> bool:
 
     # Try to get a direct match
     regex = re.compile(r"\b" + to_find + r"\b")
@@ -99,18 +201,26 @@ class IntentTransformer(Transformer):
 
 
 class RuleTransformer(Transformer):
-    def __init__(self, phrase: str, visit_tokens: bool = True) -> None:
+    def __init__(
+        self,
+        phrase: str,
+        visit_tokens: bool = True,
+        cache: Optional[MatchCache] = None,
+    ) -> None:
         super().__init__(visit_tokens)
         self.phrase = phrase
         self.tag: Optional[str] = None
+        self.cache = cache
 
     def rule(self, toks):
-        if find_in_phrase(self.phrase, " ".join(t for t in toks if t is not None)):
+        if find_in_phrase(
+            self.phrase, " ".join(t for t in toks if t is not None), self.cache
+        ):
             return toks
         return None
 
     def subst(self, toks):
-        if toks[0][0] and find_in_phrase(self.phrase, toks[0][0]):
+        if toks[0][0] and find_in_phrase(self.phrase, toks[0][0], self.cache):
             self.phrase = toks[1]
             return toks[1]
         return toks[0][0]
@@ -126,7 +236,7 @@ class RuleTransformer(Transformer):
         for tok in toks:
             if tok is None:
                 continue
-            if find_in_phrase(self.phrase, tok):
+            if find_in_phrase(self.phrase, tok, self.cache):
                 return tok
         return None
 
@@ -141,3 +251,31 @@ class RuleTransformer(Transformer):
                 self.tag,
             )
         return None, self.tag
+
+
+class RuleWidthTransformer(Transformer):
+    """Computes the maximum number of words a phrase matched by the rule can
+    span."""
+
+    def _width(self, tok) -> int:
+        if isinstance(tok, int):
+            return tok
+        return len(dequote(tok.value).split())
+
+    def rule(self, toks):
+        return sum(self._width(tok) for tok in toks)
+
+    def subst(self, toks):
+        return self._width(toks[0])
+
+    def tagging(self, toks):
+        return self._width(toks[0])
+
+    def alternative(self, toks):
+        return max(self._width(tok) for tok in toks)
+
+    def group(self, toks):
+        return sum(self._width(tok) for tok in toks)
+
+    def start(self, toks):
+        return max(toks[0], 1)
@@ -19,3 +19,14 @@ def test_command_line_parse():
     runner = CliRunner()
     help_result = runner.invoke(cli.main, ["--domain", "tests/nlp/test.domain.json", "foo bar baz"])
     assert help_result.exit_code == 0
+
+
+def test_command_line_parse_truncated():
+    """Test the CLI reports a truncated evaluation."""
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.main,
+        ["--domain", "tests/nlp/test.domain.json", "--max-seconds", "0", "foo bar baz"],
+    )
+    assert result.exit_code == 0
+    assert "'truncated': True" in result.output
@@ -1,3 +1,5 @@
+import threading
+
 import pytest
 
 from babble.nlp.engine import Engine, Understanding
@@ -43,3 +45,88 @@ def test_multi_number(engine: Engine):
     assert result is not None
     assert result.intent == "my_foo_multi_number"
     assert result.slots[1]["value"] == ["one", "two", "three"]
+
+
+def test_match_cache(engine: Engine):
+    engine.evaluate("foo bar baz")
+    misses = engine.match_cache.misses
+    assert misses > 0
+    engine.evaluate("foo bar baz")
+    assert engine.match_cache.misses == misses
+    assert engine.match_cache.hits > 0
+
+    hits = engine.match_cache.hits
+    engine.reload()
+    assert len(engine.match_cache) == 0
+    assert engine.match_cache.memory == 0
+    assert engine.match_cache.hits == hits
+
+
+def test_evaluate_during_reload(engine: Engine):
+    errors = []
+    done = threading.Event()
+
+    def evaluate():
+        while not done.is_set():
+            try:
+                assert engine.evaluate("foo bar baz").intent == "my_foo_bar_baz_intent"
+            except Exception as e:
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=evaluate) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for _ in range(20):
+        engine.reload()
+    done.set()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+
+
+@pytest.mark.parametrize(
+    "phrase,intent",
+    [
+        ("foo bar baz", "my_foo_bar_baz_intent"),
+        ("xxx foo bar baz", "my_xxx_foo_bar_baz_intent"),
+        ("zzz foo bar baz", "my_foo_bar_baz_intent"),
+        ("zzz foo baz bar", "my_foo_bar_intent"),
+    ],
+)
+def test_evaluate_bounded(engine: Engine, phrase, intent):
+    result = engine.evaluate(phrase, bounded=True)
+    assert result is not None
+    assert result.intent == intent
+    assert result.truncated is None
+    assert "truncated" not in result.as_dict()
+
+
+def test_classifiers_max_width(engine: Engine):
+    assert engine.classifiers_max_width["foo"] == 1
+    assert engine.classifiers_max_width["xxx foo"] == 2
+    assert engine.classifiers_max_width["<number>"] == 1
+
+
+def test_evaluate_with_budget(engine: Engine):
+    result = engine.evaluate("foo bar baz", max_steps=0)
+    assert result is not None
+    assert not result
+    assert result.intent is None
+    assert result.is_complete() is False
+    assert result.truncated is True
+    assert result.as_dict()["truncated"] is True
+
+    # Find the number of steps needed for a complete evaluation instead of
+    # relying on the order of the intents in the test domain.
+    for steps in range(1000):
+        result = engine.evaluate("foo bar xxx", max_steps=steps)
+        if not result.truncated:
+            break
+    else:
+        pytest.fail("Evaluation did not complete within 1000 steps")
+    assert result.intent == "my_foo_bar_intent"
+
+    result = engine.evaluate("foo bar xxx", max_steps=steps - 1)
+    assert result.truncated is True
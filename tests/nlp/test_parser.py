@@ -1,7 +1,14 @@
+import threading
+
 from lark.lark import Lark
 import pytest
 
-from babble.nlp.parser import IntentTransformer, RuleTransformer, find_in_phrase
+from babble.nlp.parser import (
+    IntentTransformer,
+    MatchCache,
+    RuleTransformer,
+    find_in_phrase,
+)
 
 
 @pytest.mark.parametrize(
@@ -55,3 +62,64 @@ def test_rules(parser: Lark, rule: str, phrase: str, expected):
 def test_find_in_phrase(phrase, tofind, result):
     result = find_in_phrase(phrase=phrase, to_find=tofind)
     assert result is result
+
+
+def test_match_cache():
+    cache = MatchCache()
+    assert find_in_phrase("foo bar", "bar", cache) is True
+    assert find_in_phrase("foo bar", "bar", cache) is True
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert len(cache) == 1
+    assert cache.memory > 0
+
+
+def test_match_cache_evicts_least_recently_used():
+    cache = MatchCache(max_bytes=0)
+    cache.put("foo", "foo", True)
+    assert len(cache) == 0
+
+    cache = MatchCache()
+    cache.put("foo", "foo", True)
+    cache.max_bytes = cache.memory * 2
+    cache.put("bar", "bar", True)
+    cache.get("foo", "foo")
+    cache.put("baz", "baz", False)
+    assert cache.get("bar", "bar") is None
+    assert cache.get("foo", "foo") is True
+    assert cache.get("baz", "baz") is False
+    assert cache.evictions == 1
+    assert cache.memory <= cache.max_bytes
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.memory == 0
+    assert cache.evictions == 1
+    cache.reset_stats()
+    assert cache.stats()["hits"] == cache.stats()["evictions"] == 0
+
+
+def test_match_cache_threads():
+    cache = MatchCache(max_bytes=4096)
+
+    def work(n: int):
+        for i in range(500):
+            find_in_phrase(f"word{i % 40} {n}", "word1", cache)
+            cache.put(f"foo{i}", "foo", True)
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.evictions > 0
+    assert cache.memory <= cache.max_bytes
+    assert cache.memory == sum(size for _, size in cache._entries.values())
+
+
+def test_match_cache_disabled():
+    cache = MatchCache(max_bytes=0)
+    assert find_in_phrase("foo bar", "bar", cache) is True
+    assert cache.stats()["misses"] == 0
+    assert len(cache) == 0